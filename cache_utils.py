@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from typing import Optional
+import threading
+import numpy as np
+
+class SemanticCache:
+    """
+    Bounded LRU of (question embedding, answer) pairs.
+
+    A new question whose normalized embedding has cosine similarity above the
+    threshold with a cached one (for the same model) reuses that answer, which
+    skips both retrieval and the LLM call.
+    """
+
+    def __init__(self, max_size: int = 256, threshold: float = 0.97):
+        self.max_size = max_size
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, q_emb: np.ndarray, model: str) -> Optional[str]:
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == model]
+            if not keys:
+                return None
+            # One vectorized dot product against all cached embeddings
+            cache_mat = np.stack([self._entries[key][0] for key in keys])
+            scores = cache_mat @ q_emb
+            best = int(np.argmax(scores))
+            if scores[best] <= self.threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]][1]
+
+    def store(self, q_emb: np.ndarray, model: str, answer: str):
+        with self._lock:
+            key = (model, tuple(np.round(q_emb, 4)))
+            self._entries[key] = (q_emb, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all answers, e.g. after the knowledge base changes."""
+        with self._lock:
+            self._entries.clear()
@@ -1,65 +1,316 @@
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
 from langchain_core.documents import Document
+from numpy_store import NumpyVectorStore
+from sentence_transformers.quantization import quantize_embeddings
+from loader_utils import EMBEDDING_MODEL_NAME, load_and_split_document, split_bytes
+import numpy as np
+import torch
+import hashlib
+import multiprocessing
 import os
+import sqlite3
+import threading
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+# Chroma inserts are cheapest in batches of roughly 50-250 items; one giant
+# add_documents() call on a large PDF stalls on transaction/HNSW updates.
+INGEST_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", 128))
+
+# EMBEDDING_BACKEND=onnx runs MiniLM on ONNX Runtime with the dynamically
+# int8-quantized AVX2 export shipped in the model repo, instead of PyTorch eager.
+# Requires `pip install "sentence-transformers[onnx]"`.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "onnx/model_qint8_avx2.onnx")
+
+# The PyTorch backend runs on a GPU when one is available. EMBEDDING_COMPILE=1
+# additionally torch.compiles the transformer on CUDA (CUDA graph capture).
+if EMBEDDING_BACKEND == "onnx":
+    EMBEDDING_DEVICE = "cpu"
+    model_kwargs = {"backend": "onnx", "model_kwargs": {"file_name": ONNX_MODEL_FILE}}
+else:
+    if torch.cuda.is_available():
+        EMBEDDING_DEVICE = "cuda"
+    elif torch.backends.mps.is_available():
+        EMBEDDING_DEVICE = "mps"
+    else:
+        EMBEDDING_DEVICE = "cpu"
+    model_kwargs = {"device": EMBEDDING_DEVICE}
+
+EMBED_BATCH_SIZE = 64 if EMBEDDING_DEVICE == "cpu" else 128
 
 embedding_function = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
+    model_name=EMBEDDING_MODEL_NAME,
+    model_kwargs=model_kwargs,
+    encode_kwargs={"batch_size": EMBED_BATCH_SIZE, "normalize_embeddings": True}
 )
 
+# The SentenceTransformer behind the LangChain wrapper. Ingestion encodes with it
+# directly in large batches instead of letting Chroma call the wrapper per add,
+# and reusing it avoids loading a second copy of the model into memory.
+_st_model = embedding_function.client
+
+if EMBEDDING_DEVICE == "cuda" and os.getenv("EMBEDDING_COMPILE", "0") == "1":
+    _st_model[0].auto_model = torch.compile(_st_model[0].auto_model, mode="reduce-overhead")
+
+# Optional int8 quantization of stored embeddings. Embeddings are unit-norm, so
+# every component lies in [-1, 1]; that analytic range is used unless a file of
+# ranges calibrated on a representative sample exists at QUANT_RANGES_PATH (see
+# save_quantization_ranges). The ranges are fixed at import and never change at
+# runtime, so documents and queries always share one scale.
+#
+# Quantization saves no memory with Chroma, which stores every vector as float32:
+# int8 values there only lose precision. It therefore always uses the NumPy store,
+# which keeps the int8 matrix as is (4x smaller than float32).
+QUANTIZE_EMBEDDINGS = os.getenv("QUANTIZE_EMBEDDINGS", "0") == "1"
+USE_NUMPY_STORE = os.getenv("USE_NUMPY_STORE", "0") == "1"
+if QUANTIZE_EMBEDDINGS and not USE_NUMPY_STORE:
+    print("⚠ QUANTIZE_EMBEDDINGS=1 saves no memory in Chroma; using the NumPy store (USE_NUMPY_STORE=1) instead")
+    USE_NUMPY_STORE = True
+QUANT_RANGES_PATH = os.getenv("QUANT_RANGES_PATH", "embedding_ranges.npy")
+MIN_CALIBRATION_VECTORS = 1000
+
+def _load_quant_ranges() -> np.ndarray:
+    dim = _st_model.get_sentence_embedding_dimension()
+    if os.path.exists(QUANT_RANGES_PATH):
+        ranges = np.load(QUANT_RANGES_PATH)
+        if ranges.shape == (2, dim) and np.all(ranges[1] > ranges[0]):
+            return ranges.astype(np.float32)
+        print(f"Ignoring invalid quantization ranges in {QUANT_RANGES_PATH}")
+    return np.vstack([-np.ones(dim), np.ones(dim)]).astype(np.float32)
+
+_quant_ranges = _load_quant_ranges() if QUANTIZE_EMBEDDINGS else None
+
+def save_quantization_ranges(calibration_embeddings: np.ndarray):
+    """
+    Calibrate int8 ranges on a representative sample of normalized embeddings and
+    save them to QUANT_RANGES_PATH. Takes effect on the next start; run it before
+    indexing, since vectors already stored keep the scale they were quantized with.
+    """
+    if len(calibration_embeddings) < MIN_CALIBRATION_VECTORS:
+        raise ValueError(
+            f"Need at least {MIN_CALIBRATION_VECTORS} embeddings to calibrate, got {len(calibration_embeddings)}"
+        )
+    low, high = calibration_embeddings.min(axis=0), calibration_embeddings.max(axis=0)
+    np.save(QUANT_RANGES_PATH, np.vstack([low, np.maximum(high, low + 1e-3)]))
+
+def quantize(embeddings: np.ndarray) -> np.ndarray:
+    """int8-quantize normalized embeddings with the fixed ranges."""
+    # Clip first: values outside the calibration ranges would otherwise wrap around in int8
+    clipped = np.clip(embeddings, _quant_ranges[0], _quant_ranges[1])
+    return quantize_embeddings(clipped, precision="int8", ranges=_quant_ranges)
+
+def to_index_space(vectors: np.ndarray) -> np.ndarray:
+    """Map normalized query vectors onto the scale of the stored embeddings."""
+    if not QUANTIZE_EMBEDDINGS:
+        return vectors
+    return quantize(vectors).astype(np.float32)
+
 # --- KEY CHANGE FOR RENDER FREE TIER ---
 # By removing `persist_directory`, ChromaDB will run in-memory.
 # This means the vector index will be lost when the app restarts or sleeps.
 # This is a necessary trade-off for the free tier.
-vectorstore = Chroma(embedding_function=embedding_function)
-
-def load_and_split_document(file_path: str) -> List[Document]:
-    if file_path.endswith('.pdf'):
-        loader = PyPDFLoader(file_path)
-    elif file_path.endswith('.docx'):
-        loader = Docx2txtLoader(file_path)
-    elif file_path.endswith('.html'):
-        loader = UnstructuredHTMLLoader(file_path)
-    elif file_path.endswith('.txt'):
-        # For text files, read directly and create documents
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text = f.read()
-        chunks = text_splitter.split_text(text)
-        # Convert text chunks to Document objects
-        docs = [Document(page_content=chunk, metadata={"source": file_path}) for chunk in chunks]
-        return docs
-    else:
-        raise ValueError(f"Unsupported file type: {file_path}")
+#
+# HNSW search_ef is raised from Chroma's default of 10 to 32 for better recall,
+# at the cost of slightly slower queries. M and construction_ef keep the defaults.
+#
+# Stored and query embeddings are unit-norm, so inner product ranks exactly like
+# cosine without the per-candidate norm computation.
+#
+# USE_NUMPY_STORE=1 (implied by QUANTIZE_EMBEDDINGS) skips Chroma for a
+# brute-force NumpyVectorStore, which is faster for small corpora and keeps int8
+# embeddings as int8 in memory.
+
+if USE_NUMPY_STORE:
+    vectorstore = NumpyVectorStore(
+        dim=_st_model.get_sentence_embedding_dimension(),
+        dtype=np.int8 if QUANTIZE_EMBEDDINGS else np.float32
+    )
+    _collection = vectorstore
+else:
+    vectorstore = Chroma(
+        embedding_function=embedding_function,
+        collection_metadata={
+            "hnsw:space": "ip",
+            "hnsw:search_ef": 32,
+        }
+    )
+    _collection = vectorstore._collection
+
+def encode_texts(texts: List[str]) -> np.ndarray:
+    """
+    Encode texts as L2-normalized float32 rows, in input order.
+
+    SentenceTransformer.encode already sorts its inputs by length before batching,
+    so similar-length chunks share a batch without any bucketing here.
+    """
+    if not texts:
+        return np.empty((0, _st_model.get_sentence_embedding_dimension()), dtype=np.float32)
+    return _st_model.encode(
+        texts,
+        batch_size=EMBED_BATCH_SIZE,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    ).astype(np.float32, copy=False)
+
+def _index_splits(splits: List[Document], file_id: int) -> List[str]:
+    texts = [split.page_content for split in splits]
+    metadatas = [{**split.metadata, 'file_id': file_id} for split in splits]
+    ids = [str(uuid.uuid4()) for _ in splits]
+
+    embeddings = encode_texts_cached(texts)
+    if QUANTIZE_EMBEDDINGS:
+        embeddings = quantize(embeddings)
 
-    documents = loader.load()
-    return text_splitter.split_documents(documents)
+    # Pass precomputed embeddings so Chroma never re-invokes the embedding function
+    for i in range(0, len(splits), INGEST_BATCH_SIZE):
+        end = i + INGEST_BATCH_SIZE
+        _collection.add(
+            embeddings=embeddings[i:end].astype(np.float32).tolist(),
+            documents=texts[i:end],
+            metadatas=metadatas[i:end],
+            ids=ids[i:end],
+        )
+    return ids
 
-def index_document_to_chroma(file_path: str, file_id: int) -> bool:
+# --- Embedding cache ---
+# sha256(embedder + chunk text) -> fp16 embedding, kept on disk so re-uploading a document
+# (common, since the in-memory index is lost on restart) skips the model entirely.
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "app_data.db")
+_SQLITE_MAX_PARAMS = 500
+
+# Different models/backends produce different vectors for the same text, so the
+# key hashes the embedder's identity along with the chunk.
+_EMBED_CACHE_NAMESPACE = "|".join([
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    ONNX_MODEL_FILE if EMBEDDING_BACKEND == "onnx" else "",
+]).encode('utf-8') + b"\0"
+
+def _init_embed_cache():
+    conn = sqlite3.connect(EMBED_CACHE_PATH)
+    conn.execute('CREATE TABLE IF NOT EXISTS embed_cache (h BLOB PRIMARY KEY, v BLOB)')
+    conn.commit()
+    conn.close()
+
+_init_embed_cache()
+
+def encode_texts_cached(texts: List[str]) -> np.ndarray:
+    """Like encode_texts, but only encodes chunks whose embedding is not cached yet."""
+    if not texts:
+        return encode_texts(texts)
+    hashes = [hashlib.sha256(_EMBED_CACHE_NAMESPACE + t.encode('utf-8')).digest() for t in texts]
+    conn = sqlite3.connect(EMBED_CACHE_PATH)
+    cached = {}
+    unique_hashes = list(set(hashes))
+    for i in range(0, len(unique_hashes), _SQLITE_MAX_PARAMS):
+        chunk = unique_hashes[i:i + _SQLITE_MAX_PARAMS]
+        placeholders = ','.join('?' * len(chunk))
+        for h, v in conn.execute(f'SELECT h, v FROM embed_cache WHERE h IN ({placeholders})', chunk):
+            cached[h] = np.frombuffer(v, dtype=np.float16)
+
+    # Encode each missing text once, even if it repeats within the document
+    misses = {}
+    for h, t in zip(hashes, texts):
+        if h not in cached:
+            misses.setdefault(h, t)
+    if misses:
+        fresh = encode_texts(list(misses.values()))
+        rows = [(h, emb.astype(np.float16).tobytes()) for h, emb in zip(misses, fresh)]
+        conn.executemany('INSERT OR IGNORE INTO embed_cache (h, v) VALUES (?, ?)', rows)
+        conn.commit()
+        cached.update(zip(misses, fresh))
+    conn.close()
+
+    return np.stack([cached[h] for h in hashes]).astype(np.float32)
+
+def embed_query(text: str) -> np.ndarray:
+    """Embed a single query as an L2-normalized float32 vector."""
+    vector = np.asarray(embedding_function.embed_query(text), dtype=np.float32)
+    # The model already normalizes; re-normalizing guards the inner-product index
+    # against a backend that doesn't
+    return vector / np.linalg.norm(vector)
+
+def retrieve(question: str, k: int = 2, embedding: Optional[np.ndarray] = None) -> List[Document]:
+    """
+    Return the k chunks most similar to the question.
+
+    Pass `embedding` (from embed_query) to reuse a query vector that was already
+    computed, e.g. for the semantic cache lookup, instead of embedding again.
+    """
+    if embedding is None:
+        embedding = embed_query(question)
+    query_vector = to_index_space(embedding[np.newaxis, :])[0]
+    return vectorstore.similarity_search_by_vector(query_vector.tolist(), k=k)
+
+def index_document_to_chroma(file_path: str, file_id: int) -> Optional[List[str]]:
+    """Index a document; returns the Chroma ids of its chunks, or None on failure."""
     try:
-        splits = load_and_split_document(file_path)
-        for split in splits:
-            split.metadata['file_id'] = file_id
+        return _index_splits(load_and_split_document(file_path), file_id)
+    except Exception as e:
+        print(f"Error indexing document: {e}")
+        return None
 
-        vectorstore.add_documents(splits)
-        return True
+def index_bytes_to_chroma(data: bytes, source: str, file_id: int) -> Optional[List[str]]:
+    """Like index_document_to_chroma, but for an upload already held in memory."""
+    try:
+        ext = os.path.splitext(source)[1].lower()
+        return _index_splits(split_bytes(data, ext, source), file_id)
     except Exception as e:
         print(f"Error indexing document: {e}")
-        return False
+        return None
+
+# One long-lived pool for parsing uploads. Workers are spawned rather than forked
+# from this multi-threaded server process, and only import the lightweight
+# loader_utils module, so they never load a copy of the embedding model.
+_loader_pool: Optional[ProcessPoolExecutor] = None
+_loader_pool_lock = threading.Lock()
+
+def _get_loader_pool() -> ProcessPoolExecutor:
+    global _loader_pool
+    with _loader_pool_lock:
+        if _loader_pool is None:
+            _loader_pool = ProcessPoolExecutor(
+                max_workers=min(os.cpu_count() or 1, 4),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _loader_pool
+
+def index_documents_to_chroma(items: List[Tuple[str, int]]) -> Dict[int, Optional[List[str]]]:
+    """
+    Index several (file_path, file_id) pairs at once.
+
+    PDF/DOCX parsing is pure-CPU work, so loading and splitting is farmed out to a
+    process pool; only the splits come back to this process for embedding, which
+    keeps a single copy of the model in memory. Maps each file_id to the Chroma
+    ids of its chunks, or None if that file failed.
+    """
+    results = {}
+    executor = _get_loader_pool()
+    futures = [(executor.submit(load_and_split_document, path), file_id) for path, file_id in items]
+    for future, file_id in futures:
+        try:
+            results[file_id] = _index_splits(future.result(), file_id)
+        except Exception as e:
+            print(f"Error indexing document with file_id {file_id}: {e}")
+            results[file_id] = None
+    return results
 
-def delete_doc_from_chroma(file_id: int):
+def delete_doc_from_chroma(file_id: int, ids: Optional[List[str]] = None):
     # This will delete from the current in-memory collection
     try:
-        # Note: This is not the most efficient way for in-memory, but it works.
-        # A more advanced approach would be to get document IDs and use vectorstore.delete(ids=...)
-        vectorstore._collection.delete(where={"file_id": file_id})
+        if ids is None:
+            # No tracked ids (e.g. documents indexed before ids were recorded):
+            # fall back to a scan over the file_id metadata
+            _collection.delete(where={"file_id": file_id})
+        elif ids:
+            _collection.delete(ids=ids)
         print(f"Deleted all documents with file_id {file_id} from in-memory store.")
         return True
     except Exception as e:
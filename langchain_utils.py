@@ -1,17 +1,47 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from chroma_utils import vectorstore
+from langchain_core.runnables import RunnableLambda
+from chroma_utils import retrieve
 from dotenv import load_dotenv
+from operator import itemgetter
+import functools
 import os
 
 load_dotenv()
 
+# Wrapper to return dict with 'answer' key for compatibility
+class RAGChainWrapper:
+    def __init__(self, chain):
+        self.chain = chain
+    
+    def invoke(self, input_text, embedding=None):
+        """
+        Invoke the RAG chain with a text input.
+        
+        Args:
+            input_text: The user's question
+            embedding: Optional precomputed query embedding, reused for retrieval
+        """
+        result = self.chain.invoke({"input": input_text, "embedding": embedding})
+        return {"answer": result}
+
+# Helper function to format documents
+def format_docs(docs):
+    return "\n\n".join(doc.page_content for doc in docs)
+
+def retrieve_context(inputs):
+    """Retrieve and format context, embedding the question only if no embedding was given"""
+    return format_docs(retrieve(inputs["input"], k=2, embedding=inputs["embedding"]))
+
+@functools.lru_cache(maxsize=8)
 def get_rag_chain(model="gemini-2.5-flash"):
     """
     Get RAG chain with Google Gemini LLM.
     
+    Chains are built once per model and reused, so the LLM client and prompt are
+    not reconstructed on every request.
+    
     Args:
         model: Gemini model name (e.g., "gemini-2.5-flash", "gemini-pro")
     """
@@ -22,8 +52,6 @@ def get_rag_chain(model="gemini-2.5-flash"):
         temperature=0
     )
     
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 2})
-    
     # Create a simple RAG prompt
     prompt = ChatPromptTemplate.from_messages([
         ("system", "You are a helpful AI assistant. Use the provided context to answer questions."),
@@ -31,29 +59,15 @@ def get_rag_chain(model="gemini-2.5-flash"):
         ("human", "{input}"),
     ])
     
-    # Helper function to format documents
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-    
     # Build the RAG chain manually
     rag_chain = (
         {
-            "context": retriever | RunnableLambda(format_docs),
-            "input": RunnablePassthrough()
+            "context": RunnableLambda(retrieve_context),
+            "input": itemgetter("input")
         }
         | prompt
         | llm
         | StrOutputParser()
     )
     
-    # Wrapper to return dict with 'answer' key for compatibility
-    class RAGChainWrapper:
-        def __init__(self, chain):
-            self.chain = chain
-        
-        def invoke(self, input_text):
-            """Invoke the RAG chain with a text input"""
-            result = self.chain.invoke(input_text)
-            return {"answer": result}
-    
     return RAGChainWrapper(rag_chain)
@@ -0,0 +1,61 @@
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
+from langchain_community.document_loaders.parsers import PyPDFParser
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_core.documents.base import Blob
+from transformers import AutoTokenizer
+from typing import List
+import io
+
+# Document loading and splitting only. Kept apart from chroma_utils so that
+# process-pool workers importing it never load the embedding model or Chroma.
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Measure chunks in model tokens rather than characters. MiniLM's window is 256
+# tokens including [CLS]/[SEP], so 254-token chunks are never silently truncated
+# and per-chunk lengths (and thus batch padding) stay uniform.
+_tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+
+def token_length(text: str) -> int:
+    return len(_tokenizer.encode(text, add_special_tokens=False))
+
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=254, chunk_overlap=32, length_function=token_length)
+
+def load_and_split_document(file_path: str) -> List[Document]:
+    if file_path.endswith('.pdf'):
+        loader = PyPDFLoader(file_path)
+    elif file_path.endswith('.docx'):
+        loader = Docx2txtLoader(file_path)
+    elif file_path.endswith('.html'):
+        loader = UnstructuredHTMLLoader(file_path)
+    elif file_path.endswith('.txt'):
+        # For text files, read directly and let the splitter build the documents
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return text_splitter.create_documents([f.read()], metadatas=[{"source": file_path}])
+    else:
+        raise ValueError(f"Unsupported file type: {file_path}")
+
+    documents = loader.load()
+    return text_splitter.split_documents(documents)
+
+def split_bytes(data: bytes, ext: str, source: str) -> List[Document]:
+    """
+    Split an in-memory upload (.txt, .pdf or .docx) without reading it back from disk.
+
+    Produces the same Documents, metadata included, as load_and_split_document does
+    for the file saved at `source`.
+    """
+    if ext == '.txt':
+        return text_splitter.create_documents([data.decode('utf-8')], metadatas=[{"source": source}])
+    elif ext == '.pdf':
+        # The parser PyPDFLoader uses, fed from memory instead of the file path
+        documents = list(PyPDFParser().lazy_parse(Blob.from_data(data, path=source)))
+    elif ext == '.docx':
+        # Imported lazily, like Docx2txtLoader does, so a missing docx2txt only affects .docx files
+        import docx2txt
+        documents = [Document(page_content=docx2txt.process(io.BytesIO(data)), metadata={"source": source})]
+    else:
+        raise ValueError(f"Unsupported file type for in-memory splitting: {ext}")
+
+    return text_splitter.split_documents(documents)
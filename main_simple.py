@@ -1,17 +1,21 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List
 import os
+import asyncio
+import json
 import sqlite3
+import threading
 import uuid
 from datetime import datetime
 import tempfile
 
-# Initialize FastAPI app
-app = FastAPI()
+# Initialize FastAPI app (orjson serializes responses much faster than stdlib json)
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # --- CORS Configuration ---
 origins = [
@@ -44,63 +48,107 @@ load_dotenv()
 RAG_ENABLED = False
 get_rag_chain = None
 index_document_to_chroma = None
+index_bytes_to_chroma = None
+index_documents_to_chroma = None
 delete_doc_from_chroma = None
+embed_query = None
+semantic_cache = None
 vectorstore = None
+_rag_lock = threading.Lock()
 
 def lazy_load_rag():
-    """Load RAG components on first use to avoid blocking server startup"""
-    global RAG_ENABLED, get_rag_chain, index_document_to_chroma, delete_doc_from_chroma, vectorstore
-    if RAG_ENABLED or get_rag_chain is not None:
+    """
+    Load RAG components without blocking server startup.
+    
+    Started in a background thread on startup; endpoints call it too, which waits
+    for the background load to finish instead of loading a second time.
+    """
+    if RAG_ENABLED:
+        return  # Already loaded
+    with _rag_lock:
+        _load_rag()
+
+def _load_rag():
+    global RAG_ENABLED, get_rag_chain, index_document_to_chroma, index_bytes_to_chroma, index_documents_to_chroma, delete_doc_from_chroma, embed_query, semantic_cache, vectorstore
+    if RAG_ENABLED:
         return  # Already loaded
     
     try:
         print("Loading RAG features...")
         from langchain_utils import get_rag_chain as _get_rag_chain
-        from chroma_utils import index_document_to_chroma as _index_doc, delete_doc_from_chroma as _delete_doc, vectorstore as _vectorstore
+        from chroma_utils import index_document_to_chroma as _index_doc, index_bytes_to_chroma as _index_bytes, index_documents_to_chroma as _index_docs, delete_doc_from_chroma as _delete_doc, embed_query as _embed_query, vectorstore as _vectorstore
+        from cache_utils import SemanticCache
         get_rag_chain = _get_rag_chain
         index_document_to_chroma = _index_doc
+        index_bytes_to_chroma = _index_bytes
+        index_documents_to_chroma = _index_docs
         delete_doc_from_chroma = _delete_doc
+        embed_query = _embed_query
+        semantic_cache = SemanticCache(max_size=256, threshold=0.97)
         vectorstore = _vectorstore
         RAG_ENABLED = True
         print("✓ RAG features loaded successfully")
     except ImportError as ie:
         print(f"⚠ ImportError loading RAG: {ie}")
         RAG_ENABLED = False
+        return
     except Exception as e:
         print(f"⚠ Error loading RAG: {type(e).__name__}: {e}")
         import traceback
         traceback.print_exc()
         RAG_ENABLED = False
+        return
+    
+    # Run one dummy query so the first real request doesn't pay for lazy model/kernel
+    # init. This is only an optimization, so a failure must not disable RAG.
+    try:
+        embed_query("warmup")
+    except Exception as e:
+        print(f"⚠ RAG warmup failed: {type(e).__name__}: {e}")
+
+@app.on_event("startup")
+def preload_rag():
+    """Load RAG components in the background so the first request doesn't wait on them"""
+    threading.Thread(target=lazy_load_rag, daemon=True).start()
 
 # --- Database Setup (SQLite) ---
 DB_PATH = "app_data.db"
 
+# One process-wide connection in WAL mode instead of a connect/close per call.
+# Autocommit (isolation_level=None) plus synchronous=NORMAL avoids a full fsync
+# per write; the lock serializes access from FastAPI's worker threads.
+_conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+_conn.execute("PRAGMA journal_mode=WAL")
+_conn.execute("PRAGMA synchronous=NORMAL")
+_conn.row_factory = sqlite3.Row
+_db_lock = threading.Lock()
+
 def init_db():
     """Initialize SQLite database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS application_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            user_query TEXT,
-            gpt_response TEXT,
-            model TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS document_store (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT,
-            upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    with _db_lock:
+        _conn.execute('''
+            CREATE TABLE IF NOT EXISTS application_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT,
+                user_query TEXT,
+                gpt_response TEXT,
+                model TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        _conn.execute('''
+            CREATE TABLE IF NOT EXISTS document_store (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT,
+                upload_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Chroma ids of each document's chunks (JSON list), used for deletion by id
+        columns = [row['name'] for row in _conn.execute('PRAGMA table_info(document_store)')]
+        if 'chroma_ids' not in columns:
+            _conn.execute('ALTER TABLE document_store ADD COLUMN chroma_ids TEXT')
 
 # Initialize database on startup
 init_db()
@@ -124,44 +172,150 @@ class DeleteFileRequest(BaseModel):
     file_id: int
 
 # --- Helper Functions ---
+def _write_application_logs(rows: List[tuple]):
+    """Insert a batch of (session_id, user_query, gpt_response, model) rows"""
+    with _db_lock:
+        _conn.executemany(
+            'INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
+            rows
+        )
+
+# Chat logs are queued and written in batches by a background task, keeping the
+# SQLite commit off the /chat request path.
+LOG_FLUSH_INTERVAL = 0.5
+LOG_FLUSH_MAX_ROWS = 100
+_LOG_STOP = object()  # sentinel that tells the flusher to finish
+_log_queue: Optional[asyncio.Queue] = None
+_log_loop: Optional[asyncio.AbstractEventLoop] = None
+_log_flusher_task: Optional[asyncio.Task] = None
+
 def insert_application_logs(session_id: str, user_query: str, gpt_response: str, model: str):
     """Log chat interaction to database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
-        (session_id, user_query, gpt_response, model)
-    )
-    conn.commit()
-    conn.close()
+    row = (session_id, user_query, gpt_response, model)
+    queue = _log_queue
+    if queue is None:
+        # Log writer not running (e.g. app used without the server lifecycle)
+        _write_application_logs([row])
+        return
+    # Called from FastAPI's worker threads, so hand the row to the event loop safely
+    _log_loop.call_soon_threadsafe(queue.put_nowait, row)
+
+async def _log_flusher(queue: asyncio.Queue):
+    """
+    Write queued logs once LOG_FLUSH_MAX_ROWS are waiting, or LOG_FLUSH_INTERVAL
+    seconds after the first row of a batch arrived. Returns after writing
+    everything queued before the _LOG_STOP sentinel.
+    """
+    stopping = False
+    while not stopping:
+        row = await queue.get()
+        if row is _LOG_STOP:
+            break
+        rows = [row]
+        deadline = _log_loop.time() + LOG_FLUSH_INTERVAL
+        while len(rows) < LOG_FLUSH_MAX_ROWS:
+            timeout = deadline - _log_loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is _LOG_STOP:
+                stopping = True
+                break
+            rows.append(row)
+        try:
+            await asyncio.to_thread(_write_application_logs, rows)
+        except Exception as e:
+            print(f"[LOGS] Error writing {len(rows)} application logs: {e}")
+
+@app.on_event("startup")
+async def start_log_writer():
+    global _log_queue, _log_loop, _log_flusher_task
+    _log_loop = asyncio.get_running_loop()
+    _log_queue = asyncio.Queue()
+    _log_flusher_task = asyncio.create_task(_log_flusher(_log_queue))
+
+@app.on_event("shutdown")
+async def stop_log_writer():
+    """Let the writer finish its last batch, then write anything queued after it"""
+    global _log_queue
+    queue = _log_queue
+    _log_queue = None  # logs from now on are written directly
+    queue.put_nowait(_LOG_STOP)
+    await _log_flusher_task
+    rows = []
+    while not queue.empty():
+        rows.append(queue.get_nowait())
+    if rows:
+        _write_application_logs(rows)
 
 def insert_document_record(filename: str) -> int:
     """Record uploaded document in database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
-    conn.commit()
-    file_id = cursor.lastrowid
-    conn.close()
-    return file_id
+    with _db_lock:
+        cursor = _conn.execute('INSERT INTO document_store (filename) VALUES (?)', (filename,))
+        return cursor.lastrowid
+
+def set_document_chroma_ids(file_id: int, chroma_ids: List[str]):
+    """Store the Chroma ids of a document's chunks"""
+    with _db_lock:
+        _conn.execute('UPDATE document_store SET chroma_ids = ? WHERE id = ?', (json.dumps(chroma_ids), file_id))
+
+def get_document_chroma_ids(file_id: int) -> Optional[List[str]]:
+    """Fetch the Chroma ids of a document's chunks, if they were recorded"""
+    with _db_lock:
+        row = _conn.execute('SELECT chroma_ids FROM document_store WHERE id = ?', (file_id,)).fetchone()
+    if row is None or row['chroma_ids'] is None:
+        return None
+    return json.loads(row['chroma_ids'])
 
 def delete_document_record(file_id: int):
     """Remove document record from database"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
-    conn.commit()
-    conn.close()
+    with _db_lock:
+        _conn.execute('DELETE FROM document_store WHERE id = ?', (file_id,))
 
 def get_all_documents() -> List[DocumentInfo]:
     """Fetch all uploaded documents"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, filename, upload_timestamp FROM document_store ORDER BY upload_timestamp DESC')
-    documents = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return documents
+    with _db_lock:
+        cursor = _conn.execute('SELECT id, filename, upload_timestamp FROM document_store ORDER BY upload_timestamp DESC')
+        return [dict(row) for row in cursor.fetchall()]
+
+ALLOWED_EXTENSIONS = {'.pdf', '.docx', '.html', '.txt'}
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", 50)) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1 << 20
+
+# Uploads up to this size (of a type chroma_utils.split_bytes can parse) are
+# indexed from the bytes already in memory instead of being read back from disk.
+IN_MEMORY_INDEX_BYTES = int(os.getenv("IN_MEMORY_INDEX_MB", 8)) * 1024 * 1024
+IN_MEMORY_INDEX_EXTENSIONS = {'.txt', '.pdf', '.docx'}
+
+async def save_upload(file: UploadFile, file_path: str, keep_bytes: int = 0) -> Optional[bytes]:
+    """
+    Stream an upload to disk in 1 MiB chunks so memory stays flat.
+    
+    If the file is at most `keep_bytes` long its contents are returned as well,
+    otherwise None.
+    """
+    written = 0
+    kept = []
+    with open(file_path, "wb") as out:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            written += len(chunk)
+            if written > MAX_UPLOAD_BYTES:
+                break
+            out.write(chunk)
+            if written <= keep_bytes:
+                kept.append(chunk)
+            else:
+                kept.clear()
+    if written > MAX_UPLOAD_BYTES:
+        os.remove(file_path)
+        raise HTTPException(
+            status_code=413,
+            detail=f"File {file.filename} exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"
+        )
+    return b"".join(kept) if keep_bytes and written <= keep_bytes else None
 
 # --- API Endpoints ---
 
@@ -190,15 +344,23 @@ def chat(query: QueryInput):
         
         if RAG_ENABLED:
             try:
-                # Get RAG chain with specified model
-                print(f"[CHAT] Getting RAG chain with model: {query.model}")
-                rag_chain = get_rag_chain(model=query.model)
+                # Near-duplicate questions are answered from the semantic cache
+                q_emb = embed_query(query.question)
+                answer = semantic_cache.lookup(q_emb, query.model)
                 
-                # Invoke RAG chain
-                print(f"[CHAT] Invoking RAG chain...")
-                result = rag_chain.invoke(query.question)
-                answer = result.get("answer", "No answer generated")
-                print(f"[CHAT] RAG chain invoked successfully")
+                if answer is not None:
+                    print(f"[CHAT] Semantic cache hit")
+                else:
+                    # Get RAG chain with specified model
+                    print(f"[CHAT] Getting RAG chain with model: {query.model}")
+                    rag_chain = get_rag_chain(model=query.model)
+                    
+                    # Invoke RAG chain
+                    print(f"[CHAT] Invoking RAG chain...")
+                    result = rag_chain.invoke(query.question, embedding=q_emb)
+                    answer = result.get("answer", "No answer generated")
+                    semantic_cache.store(q_emb, query.model, answer)
+                    print(f"[CHAT] RAG chain invoked successfully")
             except Exception as e:
                 print(f"[CHAT] Error in RAG chain: {type(e).__name__}: {e}")
                 import traceback
@@ -228,7 +390,7 @@ async def upload_document(file: UploadFile = File(...)):
         print(f"[UPLOAD] Received upload request for file: {file.filename}")
         
         # Load RAG on first use
-        lazy_load_rag()
+        await run_in_threadpool(lazy_load_rag)
         print(f"[UPLOAD] RAG_ENABLED={RAG_ENABLED}")
         
         if not RAG_ENABLED:
@@ -241,12 +403,11 @@ async def upload_document(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="No file provided")
         
         # Check file extension
-        allowed_extensions = {'.pdf', '.docx', '.html', '.txt'}
         file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
+        if file_ext not in ALLOWED_EXTENSIONS:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Unsupported file type: {file_ext}. Allowed: {', '.join(allowed_extensions)}"
+                detail=f"Unsupported file type: {file_ext}. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
             )
         
         # Create upload directory if it doesn't exist
@@ -255,10 +416,11 @@ async def upload_document(file: UploadFile = File(...)):
         # Save uploaded file
         file_path = f"uploads/{file.filename}"
         try:
-            contents = await file.read()
-            with open(file_path, "wb") as f:
-                f.write(contents)
+            keep_bytes = IN_MEMORY_INDEX_BYTES if file_ext in IN_MEMORY_INDEX_EXTENSIONS else 0
+            contents = await save_upload(file, file_path, keep_bytes=keep_bytes)
             print(f"[UPLOAD] File saved to {file_path}")
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"[UPLOAD] Error saving file: {e}")
             raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
@@ -274,7 +436,12 @@ async def upload_document(file: UploadFile = File(...)):
         # Index document to Chroma
         try:
             print(f"[UPLOAD] Starting to index document to Chroma...")
-            success = index_document_to_chroma(file_path, file_id)
+            # Parsing and embedding run off the event loop
+            if contents is not None:
+                chroma_ids = await run_in_threadpool(index_bytes_to_chroma, contents, file_path, file_id)
+            else:
+                chroma_ids = await run_in_threadpool(index_document_to_chroma, file_path, file_id)
+            success = chroma_ids is not None
             print(f"[UPLOAD] Indexing result: {success}")
         except Exception as e:
             print(f"[UPLOAD] Error indexing document: {type(e).__name__}: {e}")
@@ -285,6 +452,8 @@ async def upload_document(file: UploadFile = File(...)):
             raise HTTPException(status_code=500, detail=f"Error indexing document: {str(e)}")
         
         if success:
+            set_document_chroma_ids(file_id, chroma_ids)
+            semantic_cache.clear()
             print(f"[UPLOAD] Successfully uploaded and indexed document")
             return {
                 "message": "Document uploaded and indexed successfully",
@@ -303,6 +472,84 @@ async def upload_document(file: UploadFile = File(...)):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Unexpected error uploading document: {str(e)}")
 
+@app.post("/upload-docs")
+async def upload_documents(files: List[UploadFile] = File(...)):
+    """Upload and index several documents, parsing them in parallel"""
+    try:
+        print(f"[UPLOAD-BATCH] Received upload request for {len(files)} files")
+        
+        # Load RAG on first use
+        await run_in_threadpool(lazy_load_rag)
+        
+        if not RAG_ENABLED:
+            raise HTTPException(
+                status_code=503, 
+                detail="Document upload is not available. RAG features not initialized."
+            )
+        
+        if not files:
+            raise HTTPException(status_code=400, detail="No files provided")
+        
+        # Validate every file before touching the disk or database
+        seen_filenames = set()
+        for file in files:
+            # Files are saved as uploads/{filename}, so a repeated name would overwrite an earlier file
+            if file.filename in seen_filenames:
+                raise HTTPException(status_code=400, detail=f"Duplicate filename in batch: {file.filename}")
+            seen_filenames.add(file.filename)
+            file_ext = os.path.splitext(file.filename or "")[1].lower()
+            if file_ext not in ALLOWED_EXTENSIONS:
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Unsupported file type: {file_ext} ({file.filename}). Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+                )
+        
+        os.makedirs("uploads", exist_ok=True)
+        
+        # Save every file first so an oversized upload leaves no orphaned records
+        for file in files:
+            await save_upload(file, f"uploads/{file.filename}")
+        
+        items = []
+        filenames = {}
+        for file in files:
+            file_id = insert_document_record(file.filename)
+            items.append((f"uploads/{file.filename}", file_id))
+            filenames[file_id] = file.filename
+        
+        # Index all documents; loading/splitting runs in a process pool
+        print(f"[UPLOAD-BATCH] Starting to index {len(items)} documents to Chroma...")
+        # Runs off the event loop: parsing and embedding a whole batch takes a while
+        results = await run_in_threadpool(index_documents_to_chroma, items)
+        
+        indexed, failed = [], []
+        for file_id, chroma_ids in results.items():
+            if chroma_ids is not None:
+                set_document_chroma_ids(file_id, chroma_ids)
+                indexed.append({"file_id": file_id, "filename": filenames[file_id]})
+            else:
+                delete_document_record(file_id)
+                failed.append(filenames[file_id])
+        print(f"[UPLOAD-BATCH] Indexed {len(indexed)} documents, {len(failed)} failed")
+        
+        if not indexed:
+            raise HTTPException(status_code=400, detail="Failed to index documents")
+        semantic_cache.clear()
+        
+        return {
+            "message": f"{len(indexed)} of {len(files)} documents uploaded and indexed successfully",
+            "documents": indexed,
+            "failed": failed
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[UPLOAD-BATCH] Unexpected error: {type(e).__name__}: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Unexpected error uploading documents: {str(e)}")
+
 @app.get("/list-docs")
 def list_documents():
     """List all uploaded documents"""
@@ -326,10 +573,11 @@ def delete_document(request: DeleteFileRequest):
             )
         
         # Delete from vector store
-        success = delete_doc_from_chroma(request.file_id)
+        success = delete_doc_from_chroma(request.file_id, get_document_chroma_ids(request.file_id))
         
         # Delete from database
         if success:
+            semantic_cache.clear()
             delete_document_record(request.file_id)
             return {"message": "Document deleted successfully", "file_id": request.file_id}
         else:
@@ -0,0 +1,80 @@
+from langchain_core.documents import Document
+from typing import Dict, List, Optional
+import threading
+import numpy as np
+
+class NumpyVectorStore:
+    """
+    Brute-force in-memory vector store for small corpora.
+
+    Embeddings live in one contiguous matrix with parallel lists of ids, documents
+    and metadata. For up to tens of thousands of chunks a single matrix-vector
+    product is faster than traversing an HNSW graph. Exposes the subset of Chroma's
+    collection/vectorstore API that chroma_utils uses.
+    """
+
+    # int8 rows are scored in blocks so the float32 copy stays small
+    _SCORE_BLOCK = 4096
+
+    def __init__(self, dim: int, dtype=np.float32):
+        self._E = np.empty((0, dim), dtype=dtype)
+        self._n = 0
+        self._ids: List[str] = []
+        self._docs: List[str] = []
+        self._meta: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, embeddings, documents: List[str], metadatas: List[Dict], ids: List[str]):
+        rows = np.asarray(embeddings, dtype=self._E.dtype)
+        with self._lock:
+            # Grow geometrically so repeated batch adds don't copy the whole matrix each time
+            needed = self._n + len(rows)
+            if needed > len(self._E):
+                grown = np.empty((max(needed, 2 * len(self._E)), self._E.shape[1]), dtype=self._E.dtype)
+                grown[:self._n] = self._E[:self._n]
+                self._E = grown
+            self._E[self._n:needed] = rows
+            self._n = needed
+            self._ids.extend(ids)
+            self._docs.extend(documents)
+            self._meta.extend(metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        with self._lock:
+            if ids is not None:
+                targets = set(ids)
+                keep = [i not in targets for i in self._ids]
+            else:
+                keep = [not all(meta.get(key) == value for key, value in where.items()) for meta in self._meta]
+            if all(keep):
+                return
+            mask = np.array(keep, dtype=bool)
+            remaining = int(mask.sum())
+            self._E[:remaining] = self._E[:self._n][mask]
+            self._n = remaining
+            self._ids = [x for x, k in zip(self._ids, keep) if k]
+            self._docs = [x for x, k in zip(self._docs, keep) if k]
+            self._meta = [x for x, k in zip(self._meta, keep) if k]
+
+    def _scores(self, query: np.ndarray) -> np.ndarray:
+        E = self._E[:self._n]
+        if E.dtype == np.float32:
+            # Rows and query are unit-norm, so the dot product is the cosine similarity
+            return E @ query
+        scores = np.empty(self._n, dtype=np.float32)
+        for i in range(0, self._n, self._SCORE_BLOCK):
+            block = E[i:i + self._SCORE_BLOCK].astype(np.float32)
+            norms = np.maximum(np.linalg.norm(block, axis=1), 1e-6)
+            scores[i:i + self._SCORE_BLOCK] = (block @ query) / norms
+        return scores
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if self._n == 0:
+                return []
+            scores = self._scores(query)
+            k = min(k, self._n)
+            idx = np.argpartition(-scores, k - 1)[:k]
+            idx = idx[np.argsort(-scores[idx])]
+            return [Document(page_content=self._docs[i], metadata=self._meta[i]) for i in idx]